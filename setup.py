@@ -92,7 +92,8 @@ setup(
     # for example:
     # $ pip install -e .[dev,test]
     extras_require={
-        
+        "numba": ["numba"],
+        "hyperscan": ["hyperscan"],
     },
 
     # If there are data files included in your packages that need to be
@@ -1,8 +1,14 @@
-try:
-    #py2
-    import error_stats, generic_tools, scan_files
-except:
-    #py3+
-    from ss_utilities import error_stats, generic_tools, scan_files
+import importlib
 
 __all__ = ["error_stats", "generic_tools", "scan_files"]
+
+def __getattr__(name):
+    """Import submodules on first access (PEP 562) so that `import ss_utilities` stays cheap."""
+    if name in __all__:
+        module = importlib.import_module(f".{name}", __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,36 @@
+"""
+Helpers for optional dependencies.
+
+Numba is only detected here, not imported; the JIT kernels import it when they are first built.
+Set the environment variable `SS_UTILITIES_BACKEND=cuda` to run the supported numerical routines on
+the GPU using CuPy.
+"""
+
+import os
+from importlib.util import find_spec
+
+NUMBA_AVAILABLE = find_spec("numba") is not None
+
+BACKEND = os.environ.get("SS_UTILITIES_BACKEND", "numpy").lower()
+
+def get_array_module():
+    """Return the array module for the selected backend: CuPy if `BACKEND` is 'cuda', else NumPy."""
+    if BACKEND == "cuda":
+        import cupy
+        return cupy
+    import numpy
+    return numpy
+
+def to_device(array):
+    """Copy *array* to the GPU if using the 'cuda' backend, otherwise return it unchanged."""
+    if BACKEND == "cuda" and array is not None:
+        import cupy
+        return cupy.asarray(array)
+    return array
+
+def from_device(array):
+    """Copy *array* to host memory if using the 'cuda' backend, otherwise return it unchanged."""
+    if BACKEND == "cuda":
+        import cupy
+        return cupy.asnumpy(array)[()]
+    return array
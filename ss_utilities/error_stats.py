@@ -3,10 +3,71 @@ Common error stat calculations.
 
 Jamie Taylor
 2018-09-04
+
+`r_squared`, `wmape` and `rmse` run on the GPU via CuPy when the environment variable
+`SS_UTILITIES_BACKEND=cuda` is set.
+
+Single precision inputs are preserved: if all of the arrays passed in are float32 then the
+calculations are carried out in float32 (halving the memory traffic) and float32 is returned,
+otherwise float64 is used. The Numba kernels read float32 inputs directly but accumulate their
+sums in float64 before the result is cast back to float32.
 """
 
+from functools import lru_cache
+
 import numpy as np
 
+from ._compat import NUMBA_AVAILABLE, get_array_module, from_device
+
+@lru_cache(maxsize=None)
+def _wmape_kernel():
+    """Build the fused single-pass Numba wMAPE kernel for 1D arrays of equal length."""
+    import numba
+    @numba.njit(parallel=True, fastmath=True)
+    def kernel(predictions, actuals, norms, weights):
+        num = 0.
+        den = 0.
+        for i in numba.prange(predictions.size):
+            num += weights[i] * abs((predictions[i] - actuals[i]) / norms[i])
+            den += weights[i]
+        return 100. * num / den
+    return kernel
+
+@lru_cache(maxsize=None)
+def _sum_sq_diff_kernel():
+    """Build the fused Numba sum of squared differences kernel for 1D arrays of equal length."""
+    import numba
+    @numba.njit(parallel=True, fastmath=True)
+    def kernel(a, b):
+        total = 0.
+        for i in numba.prange(a.size):
+            diff = a[i] - b[i]
+            total += diff * diff
+        return total
+    return kernel
+
+def _use_sum_sq_diff_kernel(a, b):
+    """Check whether `_sum_sq_diff(a, b)` can use the Numba kernel."""
+    return NUMBA_AVAILABLE and isinstance(a, np.ndarray) and a.ndim == 1 and np.ndim(b) <= 1 \
+        and np.size(b) in (1, a.size)
+
+def _sum_sq_diff(a, b, buf=None):
+    """
+    Sum of the squared elementwise differences `a - b`. Uses the Numba kernel for 1D arrays when
+    available, otherwise the differences are written into `buf` (allocated if not given) and
+    reduced with a dot product.
+    """
+    xp = get_array_module()
+    a, b = xp.asarray(a), xp.asarray(b)
+    if _use_sum_sq_diff_kernel(a, b):
+        dtype = np.result_type(a, b, np.float32)
+        return dtype.type(_sum_sq_diff_kernel()(a, np.broadcast_to(b, a.shape)))
+    if buf is None:
+        buf = xp.empty(xp.broadcast(a, b).shape, dtype=xp.result_type(a, b, np.float32))
+    xp.subtract(a, b, out=buf)
+    flat = buf.reshape(-1)
+    return xp.dot(flat, flat)
+
 def r_squared(predictions, actuals):
     r"""
     Calculate the coefficient of determination (a.k.a R-Squared) [1]_.
@@ -37,10 +98,17 @@ def r_squared(predictions, actuals):
     ----------
     .. [1] https://en.wikipedia.org/wiki/Coefficient_of_determination
     """
-    mean_actual = np.mean(actuals)
-    ss_tot = np.sum(np.power(actuals - mean_actual, 2))
-    ss_res = np.sum(np.power(actuals - predictions, 2))
-    return 1 - ss_res / ss_tot
+    xp = get_array_module()
+    predictions, actuals = xp.asarray(predictions), xp.asarray(actuals)
+    buf = tot_buf = None
+    if not _use_sum_sq_diff_kernel(actuals, predictions):
+        buf = xp.empty(xp.broadcast(actuals, predictions).shape,
+                       dtype=xp.result_type(actuals, predictions, np.float32))
+        # The SS_tot pass only needs as many elements as `actuals`, so reuse the start of `buf`
+        tot_buf = buf.reshape(-1)[:actuals.size].reshape(actuals.shape)
+    ss_tot = _sum_sq_diff(actuals, xp.mean(actuals), tot_buf)
+    ss_res = _sum_sq_diff(actuals, predictions, buf)
+    return from_device(1 - ss_res / ss_tot)
 
 def pearson_coefficient(predictions, actuals):
     r"""
@@ -69,7 +137,9 @@ def pearson_coefficient(predictions, actuals):
     ----------
     .. [1] https://en.wikipedia.org/wiki/Pearson_correlation_coefficient
     """
-    return np.corrcoef(predictions, actuals)[0, 1]
+    x = predictions - np.mean(predictions)
+    y = actuals - np.mean(actuals)
+    return np.dot(x, y) / np.sqrt(np.dot(x, x) * np.dot(y, y))
 
 def wmape(predictions, actuals, norms=None, weights=None):
     r"""
@@ -100,10 +170,21 @@ def wmape(predictions, actuals, norms=None, weights=None):
         \frac{\sum_i{w_i\times\mathrm{abs}\left(\frac{f_i-y_i}{n_i}\right)\times100\%}}{\sum_i{w_i}}
         \end{gathered}
     """
-    norms = actuals if norms is None else norms
-    weights = actuals if weights is None else weights
-    mapes = np.abs((predictions - actuals) / norms) * 100.
-    return np.sum(weights * mapes) / np.sum(weights)
+    xp = get_array_module()
+    predictions, actuals = xp.asarray(predictions), xp.asarray(actuals)
+    norms = actuals if norms is None else xp.asarray(norms)
+    weights = actuals if weights is None else xp.asarray(weights)
+    arrays = (predictions, actuals, norms, weights)
+    if NUMBA_AVAILABLE and all(isinstance(a, np.ndarray) and a.ndim == 1 for a in arrays) \
+            and len({a.size for a in arrays}) == 1:
+        return np.result_type(*arrays, np.float32).type(_wmape_kernel()(*arrays))
+    dtype = xp.result_type(predictions, actuals, norms, np.float32)
+    buf = xp.empty(xp.broadcast(predictions, actuals, norms).shape, dtype=dtype)
+    xp.subtract(predictions, actuals, out=buf)
+    xp.divide(buf, norms, out=buf)
+    xp.abs(buf, out=buf)
+    weighted = xp.vdot(xp.broadcast_to(weights, buf.shape), buf)
+    return from_device(weighted * 100. / xp.sum(weights))
 
 def wmnbe(predictions, actuals, norms=None, weights=None):
     r"""
@@ -163,7 +244,10 @@ def rmse(predictions, actuals):
         \mathit{RMSE}=\sqrt{\frac{\sum_i^n{{\left (f_i-y_i \right )}^2}}{n}}
         \end{gathered}
     """
-    return np.sqrt(np.mean(np.power(predictions - actuals, 2)))
+    xp = get_array_module()
+    predictions, actuals = xp.asarray(predictions), xp.asarray(actuals)
+    n = xp.broadcast(predictions, actuals).size
+    return from_device(xp.sqrt(_sum_sq_diff(predictions, actuals) / n))
 
 def mbe(predictions, actuals):
     r"""
@@ -189,4 +273,106 @@ def mbe(predictions, actuals):
         \mathit{MBE}=\frac{\sum_i^n{\left (f_i-y_i \right )}}{n}
         \end{gathered}
     """
-    return np.mean(predictions - actuals)
+    return np.mean(np.subtract(predictions, actuals))
+
+def _batch_inputs(predictions, actuals):
+    """Convert the inputs of the `*_batch` functions to arrays, checking `predictions` is 2D."""
+    predictions, actuals = np.asarray(predictions), np.asarray(actuals)
+    if predictions.ndim != 2:
+        raise ValueError("`predictions` must be a 2D array with shape (m, n), got shape "
+                         f"{predictions.shape}")
+    return predictions, actuals
+
+def r_squared_batch(predictions, actuals):
+    """
+    Calculate the coefficient of determination for many sets of predictions at once. See
+    :func:`r_squared`.
+
+    Parameters
+    ----------
+    `predictions` : 2D numpy array of floats
+        Predictions being tested, with shape (m, n) i.e. one row per model/forecast.
+    `actuals`: numpy array of floats
+        Actual values corresponding to each row of `predictions`, with shape (n,).
+
+    Returns
+    -------
+    numpy array of floats
+        Coefficient of determination for each row of `predictions`, with shape (m,).
+    """
+    predictions, actuals = _batch_inputs(predictions, actuals)
+    deviations = actuals - np.mean(actuals)
+    residuals = predictions - actuals
+    ss_tot = np.dot(deviations, deviations)
+    ss_res = np.einsum("ij,ij->i", residuals, residuals)
+    return 1 - ss_res / ss_tot
+
+def wmape_batch(predictions, actuals, norms=None, weights=None):
+    """
+    Calculate the weighted Mean Absolute Percent Error for many sets of predictions at once. See
+    :func:`wmape`.
+
+    Parameters
+    ----------
+    `predictions` : 2D numpy array of floats
+        Predictions being tested, with shape (m, n) i.e. one row per model/forecast.
+    `actuals` : numpy array of floats
+        Actual values corresponding to each row of `predictions`, with shape (n,).
+    `norms` : numpy array of floats
+        Normalisation values, with shape (n,) or (m, n). Default is to use `actuals`.
+    `weights` : numpy array of floats
+        Weighting values, with shape (n,) or (m, n). Default is to use `actuals`.
+
+    Returns
+    -------
+    numpy array of floats
+        wMAPE for each row of `predictions`, with shape (m,).
+    """
+    predictions, actuals = _batch_inputs(predictions, actuals)
+    norms = actuals if norms is None else np.asarray(norms)
+    weights = actuals if weights is None else np.asarray(weights)
+    dtype = np.result_type(predictions, actuals, norms, np.float32)
+    buf = np.subtract(predictions, actuals, dtype=dtype)
+    np.divide(buf, norms, out=buf)
+    np.abs(buf, out=buf)
+    num = np.einsum("ij,ij->i", np.broadcast_to(weights, buf.shape), buf)
+    return num * 100. / np.sum(np.broadcast_to(weights, buf.shape), axis=1)
+
+def rmse_batch(predictions, actuals):
+    """
+    Calculate the Root Mean Square Error for many sets of predictions at once. See :func:`rmse`.
+
+    Parameters
+    ----------
+    `predictions` : 2D numpy array of floats
+        Predictions being tested, with shape (m, n) i.e. one row per model/forecast.
+    `actuals` : numpy array of floats
+        Actual values corresponding to each row of `predictions`, with shape (n,).
+
+    Returns
+    -------
+    numpy array of floats
+        RMSE for each row of `predictions`, with shape (m,).
+    """
+    predictions, actuals = _batch_inputs(predictions, actuals)
+    residuals = predictions - actuals
+    return np.sqrt(np.einsum("ij,ij->i", residuals, residuals) / residuals.shape[1])
+
+def mbe_batch(predictions, actuals):
+    """
+    Calculate the Mean Bias Error for many sets of predictions at once. See :func:`mbe`.
+
+    Parameters
+    ----------
+    `predictions` : 2D numpy array of floats
+        Predictions being tested, with shape (m, n) i.e. one row per model/forecast.
+    `actuals` : numpy array of floats
+        Actual values corresponding to each row of `predictions`, with shape (n,).
+
+    Returns
+    -------
+    numpy array of floats
+        MBE for each row of `predictions`, with shape (m,).
+    """
+    predictions, actuals = _batch_inputs(predictions, actuals)
+    return np.mean(np.subtract(predictions, actuals), axis=1)
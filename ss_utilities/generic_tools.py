@@ -6,16 +6,36 @@ A module of generic, reusable tools.
 
 """
 
+import atexit
 from datetime import datetime
+from functools import lru_cache
+import math
 import os
 import sys
-from typing import Optional, List, Dict
-import pytz
+import threading
+import warnings
+from typing import Optional, List, Dict, IO
 from calendar import monthrange
-import numpy as np
+
+# NumPy, pytz and the optional accelerators are imported where needed, to keep the package (and the
+# CLIs built on it) quick to import
+
+_SCRIPTNAME = os.path.basename(__file__)
+
+@lru_cache(maxsize=None)
+def _tz(name):
+    """Look up (and cache) the pytz timezone *name* from the Olson timezone database."""
+    import pytz
+    return pytz.timezone(name)
 
 class GenericException(Exception):
-    """A generic exception for anticipated errors."""
+    """
+    A generic exception for anticipated errors.
+
+    Creating the exception does not touch the disk; use :meth:`log_to` to also record it in a log
+    file e.g. `raise GenericException("Oops").log_to("errors.log")`. The `filename` argument is
+    deprecated in favour of :meth:`log_to`.
+    """
     def __init__(self, msg, msg_id=None, filename=None, err=None):
         if msg_id is not None:
             self.msg = "%s: %s" % (msg_id, msg)
@@ -24,15 +44,51 @@ class GenericException(Exception):
         if err is not None:
             self.msg += "\n    %s" % repr(err)
         if filename:
-            logger = GenericErrorLogger(filename)
-            logger.write_to_log(self.msg)
+            warnings.warn("The `filename` argument of GenericException is deprecated, use "
+                          "`GenericException(...).log_to(filename)` instead.", DeprecationWarning,
+                          stacklevel=2)
+            self.log_to(filename)
     def __str__(self):
         return self.msg
 
+    def log_to(self, filename):
+        """
+        Record the exception message in the logfile *filename* using :class:`GenericErrorLogger`.
+
+        Parameters
+        ----------
+        `filename` : string
+            Path to the logfile.
+        Returns
+        -------
+        GenericException
+            The exception itself, so that it can be logged and raised in one statement.
+        """
+        GenericErrorLogger(filename).write_to_log(self.msg)
+        return self
+
 class GenericErrorLogger:
-    """Basic error logging to a file (optional)."""
+    """
+    Basic error logging to a file (optional). Log files are opened once (line-buffered) and the
+    handle is shared by all loggers writing to the same file until the interpreter exits.
+    """
+    _handles: Dict[str, IO] = {}
+    _lock = threading.Lock()
+
     def __init__(self, filename):
         self.logfile = filename
+        path = os.path.abspath(filename)
+        with self._lock:
+            if path not in self._handles:
+                self._handles[path] = open(path, "a", buffering=1)
+            self.fid = self._handles[path]
+
+    @classmethod
+    def close_all(cls):
+        """Close all of the cached log file handles."""
+        with cls._lock:
+            while cls._handles:
+                cls._handles.popitem()[1].close()
 
     def write_to_log(self, msg):
         """
@@ -45,12 +101,11 @@ class GenericErrorLogger:
             Message to be recorded in *self.logfile*.
         """
         timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-        scriptname = os.path.basename(__file__)
-        fid = open(self.logfile, "a")
-        fid.write(timestamp + " " + scriptname + ": " + str(msg) + "\n")
-        fid.close()
+        self.fid.write(timestamp + " " + _SCRIPTNAME + ": " + str(msg) + "\n")
         return
 
+atexit.register(GenericErrorLogger.close_all)
+
 def send_email(
         smtp_config: Dict,
         message: str,
@@ -123,10 +178,10 @@ def to_unixtime(datetime_, timezone_=None):
                                                                     "tzinfo OR timezone_must be "
                                                                     "passed."))
     if timezone_ and not datetime_.tzinfo:
-        utc_datetime = pytz.timezone(timezone_).localize(datetime_).astimezone(pytz.utc)
+        utc_datetime = _tz(timezone_).localize(datetime_).astimezone(_tz("UTC"))
     else:
-        utc_datetime = datetime_.astimezone(pytz.utc)
-    unixtime = int((utc_datetime - datetime(1970, 1, 1, 0, 0, 0, 0, pytz.utc)).total_seconds())
+        utc_datetime = datetime_.astimezone(_tz("UTC"))
+    unixtime = int((utc_datetime - datetime(1970, 1, 1, 0, 0, 0, 0, _tz("UTC"))).total_seconds())
     return unixtime
 
 def from_unixtime(unixtime_, timezone_="UTC"):
@@ -151,12 +206,21 @@ def from_unixtime(unixtime_, timezone_="UTC"):
     """
     raise Exception("The `from_unixtime()` method is no longer supported here, use "
                     "https://github.com/SheffieldSolar/sp2ts instead.")
-    return datetime.fromtimestamp(unixtime_, tz=pytz.timezone(timezone_))
+    return datetime.fromtimestamp(unixtime_, tz=_tz(timezone_))
 
 def myround(number, base=5):
     """Round to the nearest *base*."""
     return int(base * round(float(number)/base))
 
+def myround_array(arr, base=5):
+    """
+    Round every element of the array *arr* to the nearest *base* in one vectorised operation,
+    returning integers exactly as :func:`myround` does. Prefer this over calling :func:`myround` in
+    a loop over an array.
+    """
+    import numpy as np
+    return (np.rint(np.asarray(arr, dtype=np.float64) / base) * base).astype(np.int64)
+
 def query_yes_no(question, default="yes"):
     """
     Ask a yes/no question via raw_input() and return the answer as boolean.
@@ -220,17 +284,30 @@ def print_progress(iteration, total, prefix="", suffix="", decimals=2, bar_lengt
         character length of bar (optional)
     Notes
     -----
-    Taken from `Stack Overflow <http://stackoverflow.com/a/34325723>`_.
+    Adapted from `Stack Overflow <http://stackoverflow.com/a/34325723>`_. Nothing is written unless
+    the rendered bar would change, so it is cheap to call on every iteration of a tight loop.
     """
     filled_length = int(round(bar_length * iteration / float(total)))
     percents = round(100.00 * (iteration / float(total)), decimals)
-    progress_bar = "#" * filled_length + "-" * (bar_length - filled_length)
+    state = (prefix, suffix, bar_length, filled_length, percents)
+    if state == print_progress.last_state and iteration != total:
+        return
+    print_progress.last_state = state
+    if len(print_progress.bar_full) != bar_length:
+        print_progress.bar_full = "#" * bar_length
+        print_progress.bar_empty = "-" * bar_length
+    progress_bar = print_progress.bar_full[:filled_length] + \
+        print_progress.bar_empty[filled_length:]
     sys.stdout.write("\r%s |%s| %s%s %s" % (prefix, progress_bar, percents, "%", suffix))
     sys.stdout.flush()
     if iteration == total:
         sys.stdout.write("\n")
         sys.stdout.flush()
 
+print_progress.last_state = None
+print_progress.bar_full = ""
+print_progress.bar_empty = ""
+
 def monthdelta(dt, delta):
     """Add or subtract *delta* months from the datetime *dt*."""
     y, m, d, h, mi, s = dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second
@@ -240,6 +317,48 @@ def monthdelta(dt, delta):
     new_d = min(d, monthrange(y, m)[1])
     return dt.replace(day=new_d, month=new_m, year=new_y)
 
+@lru_cache(maxsize=None)
+def _haversine_kernel():
+    """
+    Build the fused Numba haversine kernel for 1D arrays of equal length (decimal degrees), or
+    return None if Numba is not installed.
+    """
+    import numpy as np
+    from ._compat import NUMBA_AVAILABLE
+    if not NUMBA_AVAILABLE:
+        return None
+    import numba
+    @numba.njit(parallel=True, fastmath=True)
+    def kernel(lat1, lon1, lat2, lon2, radius):
+        out = np.empty_like(lat1)
+        for i in numba.prange(lat1.size):
+            phi1 = math.radians(lat1[i])
+            phi2 = math.radians(lat2[i])
+            sin_dlat = math.sin(0.5 * (phi2 - phi1))
+            sin_dlon = math.sin(0.5 * math.radians(lon2[i] - lon1[i]))
+            a = sin_dlat * sin_dlat + math.cos(phi1) * math.cos(phi2) * sin_dlon * sin_dlon
+            out[i] = 2.0 * radius * math.asin(math.sqrt(a))
+        return out
+    return kernel
+
+@lru_cache(maxsize=None)
+def _haversine_cuda_kernel():
+    """Build the fused CuPy elementwise haversine kernel (decimal degrees)."""
+    import cupy
+    return cupy.ElementwiseKernel(
+        "float64 lat1, float64 lon1, float64 lat2, float64 lon2, float64 radius",
+        "float64 dist",
+        """
+        const double deg = 0.017453292519943295;
+        double phi1 = lat1 * deg;
+        double phi2 = lat2 * deg;
+        double sin_dlat = sin(0.5 * (phi2 - phi1));
+        double sin_dlon = sin(0.5 * deg * (lon2 - lon1));
+        double a = sin_dlat * sin_dlat + cos(phi1) * cos(phi2) * sin_dlon * sin_dlon;
+        dist = 2.0 * radius * asin(sqrt(a));
+        """,
+        "ss_utilities_haversine")
+
 def haversine_np(lat1, lon1, lat2, lon2, units="km"):
     """
     Calculate the great circle distance between two points
@@ -259,6 +378,9 @@ def haversine_np(lat1, lon1, lat2, lon2, units="km"):
         Longitudes of point(s) of interest as either Numpy array of dtype float or single float.
     `units` : str
         One of: 'km' (default), 'm', 'mi'.
+    Notes
+    -----
+    Runs on the GPU via CuPy when the environment variable `SS_UTILITIES_BACKEND=cuda` is set.
     """
     avg_earth_radius_km = 6371.0088
     unit_conversion = {
@@ -267,27 +389,59 @@ def haversine_np(lat1, lon1, lat2, lon2, units="km"):
         "mi": 0.621371192,
     }
     avg_earth_radius = avg_earth_radius_km * unit_conversion[units]
-    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
-    c = 2.0 * np.arcsin(np.sqrt(a))
-    hav_dist = avg_earth_radius * c
-    return hav_dist
+    import numpy as np
+    from ._compat import BACKEND, to_device, from_device
+    if BACKEND == "cuda":
+        coords = [to_device(x).astype(float) for x in (lat1, lon1, lat2, lon2)]
+        return from_device(_haversine_cuda_kernel()(*coords, avg_earth_radius))
+    lat1, lon1, lat2, lon2 = (x if np.isscalar(x) else np.asarray(x)
+                              for x in (lat1, lon1, lat2, lon2))
+    shape = np.broadcast(lat1, lon1, lat2, lon2).shape
+    dtype = np.result_type(lat1, lon1, lat2, lon2, 1.0)
+    if len(shape) == 1 and _haversine_kernel() is not None:
+        coords = [np.broadcast_to(np.asarray(x, dtype=dtype), shape)
+                  for x in (lat1, lon1, lat2, lon2)]
+        return _haversine_kernel()(*coords, avg_earth_radius)
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    hav_dist = np.empty(shape, dtype=dtype)
+    buf = np.empty(shape, dtype=dtype)
+    # cos(phi1) * cos(phi2) * sin^2(dlon / 2)
+    np.subtract(lon2, lon1, out=hav_dist)
+    np.multiply(hav_dist, np.pi / 360.0, out=hav_dist)
+    np.sin(hav_dist, out=hav_dist)
+    np.square(hav_dist, out=hav_dist)
+    np.multiply(hav_dist, np.cos(phi1), out=hav_dist)
+    np.multiply(hav_dist, np.cos(phi2), out=hav_dist)
+    # sin^2(dlat / 2)
+    np.subtract(phi2, phi1, out=buf)
+    np.multiply(buf, 0.5, out=buf)
+    np.sin(buf, out=buf)
+    np.square(buf, out=buf)
+    np.add(hav_dist, buf, out=hav_dist)
+    np.sqrt(hav_dist, out=hav_dist)
+    np.arcsin(hav_dist, out=hav_dist)
+    np.multiply(hav_dist, 2.0 * avg_earth_radius, out=hav_dist)
+    return hav_dist[()]
 
 def ascii_bar_chart(data, title="ASCII Bar Chart", maxwidth=100, show_values=True, barchar="#"):
     title_pad_l = " " * ((maxwidth - len(title)) // 2)
     title_pad_r = " " * (maxwidth - len(title) - len(title_pad_l))
-    output = "{0}\n{1}{2}{3}\n{0}\n".format("-" * maxwidth, title_pad_l, title, title_pad_r)
-    max_label_width = max([len(r[0]) for r in data]) if show_values else 0
-    max_val = max([r[1] for r in data])
+    rows = ["{0}\n{1}{2}{3}\n{0}".format("-" * maxwidth, title_pad_l, title, title_pad_r)]
+    max_label_width = 0
+    max_val = None
+    for label, value in data:
+        if show_values and len(label) > max_label_width:
+            max_label_width = len(label)
+        if max_val is None or value > max_val:
+            max_val = value
     right_space = 10 + len("{}".format(max_val))
     bar_inc = max_val / float(maxwidth - max_label_width - right_space)
     for label, value in data:
         val_label = " {}".format(value) if show_values else ""
-        bars = barchar * int(np.floor(float(value) / bar_inc))
-        bars = "[{}]".format(bars) if value > 0. else ""
+        bars = "[{}]".format(barchar * int(value / bar_inc)) if value > 0. else ""
         left_pad = " " * (max_label_width - len(label) + 2)
-        output += "{}{} | {}{}\n".format(left_pad, label, bars, val_label)
-    output += "{}\n".format("-" * maxwidth)
-    return output
+        rows.append("{}{} | {}{}".format(left_pad, label, bars, val_label))
+    rows.append("-" * maxwidth)
+    rows.append("")
+    return "\n".join(rows)
@@ -9,8 +9,18 @@ inside.
 
 import os
 import sys
-import glob
+import re
+import mmap
+import fnmatch
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
 
 global quiet
 quiet = True
@@ -30,9 +40,11 @@ def parse_options():
                         help="Specify a path to search in (default is CWD).")
     parser.add_argument("-r", "--recursive", dest="recursive", action="store_true", required=False,
                         help="Specify to search for files recursively.")
-    parser.add_argument("--find", metavar="<some-string>", dest="find", action="store",
-                        type=str, required=False, default=None,
-                        help="Specify a string to look for in matched files.")
+    parser.add_argument("--find", metavar="<some-string>[ <some-string2>]", dest="find",
+                        action="store", nargs="+", type=str, required=False, default=None,
+                        help="Specify a string to look for in matched files. Can specify multiple "
+                             "strings separated by spaces, in which case files containing any of "
+                             "them are matched.")
     parser.add_argument("--replace", metavar="<some-string>", dest="replace", action="store",
                         type=str, required=False, default=None,
                         help="Specify a string to replace with in matched files (must be used in "
@@ -65,21 +77,98 @@ def print_results(results, filename=None):
                 fid.write(f"{file}\n")
         print(f"    -> Results were printed to '{filename}'")
 
+def iter_files(path, extensions=["*"], recursive=False):
+    """
+    Yield the paths of files in *path* whose extension matches one of *extensions*
+    (case-insensitive glob patterns, so '*' matches any file name containing a period), descending
+    into subdirectories if *recursive*. Hidden files and directories are skipped.
+    """
+    pattern = re.compile("|".join(fnmatch.translate(f"*.{ext}") for ext in extensions),
+                         re.IGNORECASE)
+    return _walk(path, pattern, recursive)
+
+def _walk(path, pattern, recursive):
+    """Recursive helper for `iter_files`, matching file names against the compiled *pattern*."""
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        # Skip directories that can't be read, as glob does
+        return
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            if recursive:
+                yield from _walk(entry.path, pattern, recursive)
+        elif entry.is_file() and pattern.match(entry.name):
+            yield entry.path
+
+def compile_needles(needles):
+    """
+    Compile a Hyperscan database matching any of the byte strings *needles* literally, so that a
+    file can be checked for all of them in a single pass. Returns None if Hyperscan is not
+    installed (or cannot handle the needles), in which case each needle is searched separately.
+    """
+    if hyperscan is None or not all(needles):
+        return None
+    database = hyperscan.Database()
+    database.compile(expressions=list(needles), ids=list(range(len(needles))),
+                     flags=[hyperscan.HS_FLAG_SINGLEMATCH] * len(needles), literal=True)
+    return database
+
+def _on_match(*args):
+    """Hyperscan match handler which stops the scan at the first match."""
+    return True
+
+def _thread_scratch(database, scratches):
+    """Return this thread's Hyperscan scratch space from *scratches*, allocating it on first use."""
+    scratch = getattr(scratches, "scratch", None)
+    if scratch is None:
+        scratch = scratches.scratch = hyperscan.Scratch(database)
+    return scratch
+
+def file_contains(file, find, database=None, scratches=None):
+    """
+    Check whether *file* contains any of the byte strings in *find*, without reading it all into
+    memory. If given, *database* should be the result of `compile_needles(find)` and *scratches* a
+    `threading.local` used to hold one Hyperscan scratch space per thread.
+    """
+    with open(file, "rb") as fid:
+        if os.fstat(fid.fileno()).st_size == 0:
+            return not all(find)
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if database is None:
+                return any(mm.find(needle) != -1 for needle in find)
+            try:
+                scratches = threading.local() if scratches is None else scratches
+                database.scan(mm, match_event_handler=_on_match,
+                              scratch=_thread_scratch(database, scratches))
+            except hyperscan.ScanTerminated:
+                return True
+            return False
+
 def find_in_files(files, find, replace=None):
     if find is None:
         return files
-    results = []
-    for file in files:
-        found = False
-        with open(file, "r+b") as fid:
-            # import pdb; pdb.set_trace()
-            content = fid.read()
-            if find in content:
-                results.append(file)
-                found = True
-        if found and replace is not None:
-            with open(file, "w+b") as fid:
-                fid.write(content.replace(find, replace))
+    files = list(files)
+    find = [find] if isinstance(find, bytes) else list(find)
+    database = compile_needles(find)
+    # Opening and mapping files releases the GIL but mmap.find does not, so the threads mainly
+    # overlap filesystem latency; the executor's default pool size is plenty for that
+    with ThreadPoolExecutor() as executor:
+        hits = executor.map(partial(file_contains, find=find, database=database,
+                                    scratches=threading.local()), files)
+        results = [file for file, hit in zip(files, hits) if hit]
+    if replace is not None:
+        # Replace all of the needles in a single pass (longest first where they overlap), so that
+        # text inserted for one needle is never rewritten for another
+        needles = re.compile(b"|".join(re.escape(n) for n in sorted(find, key=len, reverse=True)))
+        for file in results:
+            with open(file, "rb") as fid:
+                content = fid.read()
+            with open(file, "wb") as fid:
+                fid.write(needles.sub(lambda match: replace, content))
     return results
 
 def myprint(msg):
@@ -90,16 +179,15 @@ def myprint(msg):
 def scan_files(path, extensions=["*"], recursive=False, find=None, replace=None, outfile=None,
                encoding="utf-8"):
     myprint(f"Scanning '{path}' for files with extensions: {extensions}, recursive={recursive}...")
-    path = os.path.join(path, "**") if recursive else path
-    files = []
-    for extension in extensions:
-        files += glob.glob(os.path.join(path, f"*.{extension}"), recursive=recursive)
+    files = list(iter_files(path, extensions, recursive))
     myprint(f"    -> Found {len(files)} files matching the extension")
-    find_ = find.encode(encoding) if find is not None else find
+    find = [find] if isinstance(find, str) else find
+    find_ = [f.encode(encoding) for f in find] if find is not None else find
     replace_ = bytes(replace.encode(encoding)) if replace is not None else replace
     results = find_in_files(files, find_, replace_)
     if find is not None:
-        myprint(f"    -> {len(results)} out of {len(files)} files contain the string '{find}'")
+        myprint(f"    -> {len(results)} out of {len(files)} files contain any of the strings "
+                f"{find}")
     print_results(results, outfile)
 
 def main():